@@ -2,16 +2,11 @@
 import asyncio
 from bleak import BleakClient, BleakScanner
 
-# Modes (2 bits)
-MODE_STOP     = 0b00
-MODE_START    = 0b01
-
-# Wave modes
-WAVE_SQUARE = 0
-WAVE_SINE   = 1
-
-ACTUATOR_COUNT = 32
-ACTUATORS_PER_GROUP = 8
+from .protocol import WAVE_SINE, Command, check_ranges, pack_commands, pack_frame
+# Protocol constants re-exported for code that imported them from here before protocol.py
+from .protocol import (  # noqa: F401
+    ACTUATOR_COUNT, ACTUATORS_PER_GROUP, MODE_START, MODE_STOP, WAVE_SQUARE,
+)
 
 class BLE_API:
     def __init__(self):
@@ -28,23 +23,16 @@ class BLE_API:
         start_or_stop = int(start_or_stop) & 0x01
         wave = int(self.default_wave if wave is None else wave) & 0x01
 
-        if not (0 <= addr < ACTUATOR_COUNT): raise ValueError(f"addr out of range: {addr}")
-        if not (0 <= duty <= 31): raise ValueError(f"duty out of range: {duty}")
-        if not (0 <= freq <= 7):  raise ValueError(f"freq out of range: {freq}")
-
-        group = (addr // ACTUATORS_PER_GROUP) & 0x0F
-        addr6 = (addr % ACTUATORS_PER_GROUP) & 0x3F
-        mode  = MODE_START if start_or_stop else MODE_STOP
-
-        b1 = (wave << 7) | (group << 2) | mode
-        b2 = addr6
-        b3 = ((duty & 0x1F) << 3) | (freq & 0x07)
-        return bytearray([b1, b2, b3])
+        check_ranges(addr, duty, freq)
+        buf = bytearray(3)
+        pack_frame(buf, 0, addr, duty, freq, start_or_stop, wave)
+        return buf
 
     def send_command(self, addr, duty, freq, start_or_stop, wave=None) -> bool:
         if not self.connected or self.client is None:
             return False
         try:
+            # A single 3-byte frame always fits in one write: no MTU split needed
             pkt = self.create_command(addr, duty, freq, start_or_stop, wave)
             asyncio.get_event_loop().run_until_complete(
                 self.client.write_gatt_char(self.CHARACTERISTIC_UUID, pkt, response=False))
@@ -57,18 +45,28 @@ class BLE_API:
         if not self.connected or self.client is None:
             return False
         try:
-            buf = bytearray()
-            for c in commands:
-                buf += self.create_command(
-                    c.get('addr', 0), c.get('duty', 0), c.get('freq', 3),
-                    c.get('start_or_stop', 0), c.get('wave', None))
-            asyncio.get_event_loop().run_until_complete(
-                self.client.write_gatt_char(self.CHARACTERISTIC_UUID, buf, response=False))
+            # Command objects (already checked) or dicts, whose missing fields keep their defaults
+            commands = [c if isinstance(c, Command) else Command(
+                            c.get('addr', 0), c.get('duty', 0), c.get('freq', 3),
+                            c.get('start_or_stop', 0), c.get('wave', None))
+                        for c in commands]
+            buf = bytearray(3 * len(commands))
+            pack_commands(buf, 0, commands, self.default_wave)
+            asyncio.get_event_loop().run_until_complete(self._write_frames(buf))
             return True
         except Exception as e:
             print(f"BLE send_command_list failed: {e}")
             return False
 
+    async def _write_frames(self, buf):
+        # A write without response must fit in one ATT payload (MTU - 3) and the controller
+        # drops writes that are not a multiple of 3 bytes: split on whole frames, all chunks
+        # issued from a single event-loop run.
+        char = self.client.services.get_characteristic(self.CHARACTERISTIC_UUID)
+        chunk = max(3, char.max_write_without_response_size // 3 * 3)
+        for i in range(0, len(buf), chunk):
+            await self.client.write_gatt_char(char, buf[i:i + chunk], response=False)
+
     # ---------- BLE I/O ----------
     def get_ble_devices(self, timeout=5.0):
         devices = asyncio.get_event_loop().run_until_complete(BleakScanner.discover(timeout=timeout))
@@ -77,7 +75,8 @@ class BLE_API:
     def connect_ble_device(self, device_info=None) -> bool:
         async def _connect():
             if device_info:
-                address = device_info.split(' - ')[0]
+                # "address - name" (get_ble_devices) or a BLEDevice object
+                address = getattr(device_info, 'address', None) or device_info.partition(' - ')[0]
             else:
                 print(f"Scanning for '{self.DEVICE_NAME}'...")
                 devices = await BleakScanner.discover(timeout=10.0)
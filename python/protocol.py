@@ -0,0 +1,95 @@
+# protocol.py — 3-byte PC → ESP32 frame, shared by the serial and BLE APIs
+import operator
+import struct
+from typing import NamedTuple, Optional
+
+# Modes (2 bits)
+MODE_STOP     = 0b00
+MODE_START    = 0b01
+MODE_SOFTSTOP = 0b10
+MODE_RSVD     = 0b11
+
+# Wave modes
+WAVE_SQUARE = 0
+WAVE_SINE   = 1
+
+ACTUATOR_COUNT = 32
+ACTUATORS_PER_GROUP = 8
+
+# addr // ACTUATORS_PER_GROUP and addr % ACTUATORS_PER_GROUP as bit operations
+_GROUP_SHIFT = ACTUATORS_PER_GROUP.bit_length() - 1
+_LOCAL_ADDR_MASK = ACTUATORS_PER_GROUP - 1
+assert ACTUATORS_PER_GROUP == 1 << _GROUP_SHIFT
+
+# PC → ESP frame: 3 unsigned bytes (b1, b2, b3)
+_FRAME = struct.Struct('BBB')
+
+# Required fields of a dict command (wave stays optional)
+_COMMAND_FIELDS = operator.itemgetter('addr', 'duty', 'freq', 'start_or_stop')
+
+
+def check_ranges(addr, duty, freq):
+    # One combined test on the normal path; the per-field checks only run on error
+    if (addr | duty | freq) < 0 or addr >= ACTUATOR_COUNT or duty > 31 or freq > 7:
+        if not (0 <= addr < ACTUATOR_COUNT): raise ValueError(f"addr out of range: {addr} (0..31)")
+        if not (0 <= duty <= 31): raise ValueError(f"duty5 out of range: {duty} (0..31)")
+        raise ValueError(f"freq3 out of range: {freq} (0..7)")
+
+
+def pack_frame(buf, offset, addr, duty, freq, start_or_stop, wave):
+    """
+    Writes one frame into buf[offset:offset+3] (see docs/protocol.md):
+      Byte1: [W][0][G3..G0][M1][M0]   Byte2: [0][0][A5..A0]   Byte3: [D4..D0][F2..F0]
+    Ints only, already checked with check_ranges; start_or_stop and wave are 0/1.
+    """
+    # Ranges already checked, so no extra masking. group = addr // 8, addr6 = addr % 8,
+    # mode = start_or_stop (MODE_START=1, MODE_STOP=0)
+    b1 = (wave << 7) | ((addr >> _GROUP_SHIFT) << 2) | start_or_stop
+    b2 = addr & _LOCAL_ADDR_MASK
+    b3 = (duty << 3) | freq
+    _FRAME.pack_into(buf, offset, b1, b2, b3)
+
+
+class _CommandFields(NamedTuple):
+    addr: int
+    duty: int
+    freq: int
+    start_or_stop: int
+    wave: Optional[int] = None
+
+
+class Command(_CommandFields):
+    """
+    Typed command (compact named tuple), converted and checked once at construction.
+    Accepted by the serial and BLE send_command_list (and queue_command_list) instead of a dict.
+    wave=None → the API's default_wave at send time.
+    """
+    __slots__ = ()
+
+    def __new__(cls, addr, duty, freq, start_or_stop, wave=None):
+        addr = int(addr); duty = int(duty); freq = int(freq)
+        start_or_stop = int(start_or_stop) & 0x01
+        if wave is not None:
+            wave = int(wave) & 0x01
+        check_ranges(addr, duty, freq)
+        return super().__new__(cls, addr, duty, freq, start_or_stop, wave)
+
+    @classmethod
+    def _make(cls, iterable):
+        # _replace() goes through _make: keep the checks
+        return cls(*iterable)
+
+
+def pack_commands(buf, offset, commands, default_wave):
+    """
+    Writes each command at its own offset in buf (sized by the caller to 3 * len(commands)).
+    commands: Command objects, or dicts with addr, duty, freq, start_or_stop and optional wave.
+    """
+    default_wave = int(default_wave) & 0x01
+    for c in commands:
+        # Dicts are converted to Command once; a Command is already checked, so no re-check here
+        if not isinstance(c, Command):
+            c = Command(*_COMMAND_FIELDS(c), c.get('wave', None))
+        addr, duty, freq, sos, wave = c
+        pack_frame(buf, offset, addr, duty, freq, sos, default_wave if wave is None else wave)
+        offset += 3
@@ -1,22 +1,58 @@
 # serial_api.py — 3-byte protocol (wave + mode), duty en 5 bits (0..31)
 import serial
 import serial.tools.list_ports
+import queue
+import threading
 import time
+import weakref
+from collections import deque
 
-# Modes (2 bits)
-MODE_STOP     = 0b00
-MODE_START    = 0b01
-MODE_SOFTSTOP = 0b10
-MODE_RSVD     = 0b11
+from .protocol import check_ranges, pack_commands, pack_frame
+# Noms ré-exportés: ils étaient définis ici avant protocol.py
+from .protocol import (  # noqa: F401
+    ACTUATOR_COUNT, ACTUATORS_PER_GROUP, MODE_RSVD, MODE_SOFTSTOP, MODE_START, MODE_STOP,
+    Command,
+)
+
+# Attente max (s) de la bannière "Ready" envoyée par le contrôleur à la fin de son setup()
+CONNECT_TIMEOUT = 2.0
+READY_BANNER = b'Ready'
+
+# Durée de validité (s) de la liste de ports renvoyée par get_serial_devices
+PORTS_CACHE_TTL = 0.5
+
+# Thread d'écriture (threaded_writes=True): nombre max de paquets en file (au-delà,
+# l'appelant attend) et taille max d'un write regroupant plusieurs paquets déjà en file
+WRITE_QUEUE_SIZE = 64
+WRITE_COALESCE_BYTES = 4096
+
+
+def _shutdown_writer(tx_queue, writer):
+    # Appelé par disconnect, par le ramasse-miettes ou à la sortie de l'interpréteur:
+    # ne référence pas l'instance SERIAL_API pour ne pas la garder en vie
+    tx_queue.put(None)  # sentinelle: le thread envoie d'abord tout ce qui est en file
+    if writer is not threading.current_thread():
+        writer.join()
 
-ACTUATOR_COUNT = 32
-ACTUATORS_PER_GROUP = 8
 
 class SERIAL_API:
-    def __init__(self):
+    def __init__(self, threaded_writes=False):
         self.MOTOR_UUID = 'f22535de-5375-44bd-8ca9-d0ea9ff9e410'  # compat
         self.serial_connection = None
         self.connected = False
+        # Commandes encodées en attente d'un flush() (un seul write pour plusieurs lots)
+        self._pending = bytearray()
+        # Par défaut les write() sont synchrones. threaded_writes=True: ils passent par un thread
+        # dédié (démarré à la connexion) et les envois renvoient True dès la mise en file.
+        self.threaded_writes = threaded_writes
+        self._tx_queue = None
+        self._writer = None
+        self._writer_finalizer = None
+        # Erreurs du thread d'écriture pas encore signalées (cf. pop_write_error)
+        self._write_errors = deque()
+        # Cache de l'énumération des ports (évite de re-parcourir l'OS à chaque poll UI)
+        self._ports_cache = None
+        self._ports_cache_t = 0.0
         # Par défaut: sinus (1). Mets 0 pour square.
         self.default_wave = 1
 
@@ -34,6 +70,12 @@ class SERIAL_API:
                   D: duty5  (0..31)
                   F: freq3  (0..7)
         """
+        buf = bytearray(3)
+        self.pack_command_into(buf, 0, addr, duty, freq, start_or_stop, wave=wave)
+        return buf
+
+    def pack_command_into(self, buf, offset, addr, duty, freq, start_or_stop, wave=None):
+        """Writes the 3-byte command directly into buf[offset:offset+3] (cf. create_command)."""
         addr = int(addr); duty = int(duty); freq = int(freq)
         start_or_stop = int(start_or_stop) & 0x01
         if wave is None:
@@ -41,27 +83,18 @@ class SERIAL_API:
         else:
             wave = int(wave) & 0x01
 
-        # bornes
-        if not (0 <= addr < ACTUATOR_COUNT): raise ValueError(f"addr out of range: {addr} (0..31)")
-        if not (0 <= duty <= 31): raise ValueError(f"duty5 out of range: {duty} (0..31)")
-        if not (0 <= freq <= 7):  raise ValueError(f"freq3 out of range: {freq} (0..7)")
-
-        group  = (addr // ACTUATORS_PER_GROUP) & 0x0F
-        addr6  = (addr  %  ACTUATORS_PER_GROUP) & 0x3F
-        mode   = MODE_START if start_or_stop == 1 else MODE_STOP
-
-        b1 = (wave << 7) | (group << 2) | mode
-        b2 = addr6
-        b3 = ((duty & 0x1F) << 3) | (freq & 0x07)
-        return bytearray([b1, b2, b3])
+        check_ranges(addr, duty, freq)
+        pack_frame(buf, offset, addr, duty, freq, start_or_stop, wave)
 
     def send_command(self, addr, duty, freq, start_or_stop, wave=None) -> bool:
         """Envoie UNE commande 3 octets. Param wave optionnel (0=square,1=sine)."""
         if self.serial_connection is None or not self.connected:
             return False
         try:
-            pkt = self.create_command(addr, duty, freq, start_or_stop, wave=wave)
-            self.serial_connection.write(pkt)
+            # Chemin direct pour une trame (pas de dict/liste/Command intermédiaires)
+            buf = bytearray(3)
+            self.pack_command_into(buf, 0, addr, duty, freq, start_or_stop, wave=wave)
+            self._write(buf)
             return True
         except Exception as e:
             print(f"Serial failed to send command to #{addr} (duty5={duty}, freq={freq}, start={start_or_stop}, wave={wave}). Error: {e}")
@@ -69,42 +102,167 @@ class SERIAL_API:
 
     def send_command_list(self, commands) -> bool:
         """
-        commands: liste de dicts avec clés:
+        commands: liste de Command, ou de dicts avec clés:
           - addr (0..31), duty (0..31), freq (0..7), start_or_stop (0/1), wave (0/1, optionnel)
+        True = lot écrit sur le port. Avec threaded_writes=True: lot validé et mis en file
+        d'écriture (cf. pop_write_error); disconnect_serial_device() attend la fin des envois.
         """
         if self.serial_connection is None or not self.connected:
             return False
         try:
-            buf = bytearray()
-            for c in commands:
-                addr = int(c.get('addr', -1))
-                duty = int(c.get('duty', -1))
-                freq = int(c.get('freq', -1))
-                sos  = int(c.get('start_or_stop', -1))
-                wave = c.get('wave', None)
-                buf += self.create_command(addr, duty, freq, sos, wave=wave)
-            self.serial_connection.write(buf)
+            commands = list(commands)  # accepte tout itérable (générateur…), pas seulement une liste
+            # Buffer pré-dimensionné propre à ce lot (remis tel quel à _write)
+            buf = bytearray(3 * len(commands))
+            pack_commands(buf, 0, commands, self.default_wave)
+            self._write(buf)
             return True
         except Exception as e:
             print(f"Serial failed to send command list {commands}. Error: {e}")
             return False
 
+    def queue_command_list(self, commands) -> bool:
+        """
+        Encode les commandes (Command ou dicts, comme send_command_list) à la suite du buffer
+        en attente, sans rien écrire. Les lots sont envoyés ensemble par flush().
+        """
+        start = len(self._pending)
+        try:
+            commands = list(commands)
+            self._pending.extend(bytes(3 * len(commands)))
+            pack_commands(self._pending, start, commands, self.default_wave)
+            return True
+        except Exception as e:
+            del self._pending[start:]
+            print(f"Serial failed to queue command list {commands}. Error: {e}")
+            return False
+
+    def flush(self) -> bool:
+        """Envoie en un seul write toutes les commandes mises en attente par queue_command_list."""
+        if self.serial_connection is None or not self.connected:
+            return False
+        if not self._pending:
+            return True
+        # Le buffer en attente est cédé à _write (pas de copie); on repart d'un neuf
+        data, self._pending = self._pending, bytearray()
+        try:
+            self._write(data)
+            return True
+        except Exception as e:
+            print(f"Serial failed to flush {len(data) // 3} queued commands. Error: {e}")
+            return False
+
     # ---------- Serial I/O ----------
+    def _write(self, data):
+        if self._writer is None:
+            self.serial_connection.write(data)
+            return
+        # Une erreur du thread fait échouer l'envoi suivant (comme un write synchrone raté);
+        # ce lot n'est alors pas mis en file.
+        error = self.pop_write_error()
+        if error is not None:
+            raise error
+        # data appartient désormais au thread d'écriture: l'appelant ne doit plus le modifier.
+        # File pleine: put() attend que le thread rattrape son retard (on ne jette jamais de STOP).
+        self._tx_queue.put(data)
+
+    def pop_write_error(self):
+        """
+        threaded_writes=True: renvoie (et oublie) la plus ancienne erreur d'écriture du thread
+        pas encore signalée, sinon None. Chaque erreur non lue fait échouer un envoi suivant.
+        """
+        try:
+            return self._write_errors.popleft()
+        except IndexError:
+            return None
+
+    def _start_writer(self):
+        self._tx_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._writer = threading.Thread(target=self._drain_writes,
+                                        args=(self.serial_connection, self._tx_queue,
+                                              self._write_errors),
+                                        name='serial-writer', daemon=True)
+        self._writer.start()
+        # Script qui se termine sans disconnect (ou instance abandonnée): on vide quand même
+        # la file (ex. dernier STOP). Le thread ne référence pas l'instance, qui reste collectable.
+        self._writer_finalizer = weakref.finalize(self, _shutdown_writer,
+                                                  self._tx_queue, self._writer)
+
+    def _stop_writer(self):
+        if self._writer is None:
+            return
+        self._writer_finalizer()
+        self._writer_finalizer = None
+        self._writer = None
+        self._tx_queue = None
+
+    @staticmethod
+    def _drain_writes(conn, tx_queue, errors):
+        while True:
+            frames = [tx_queue.get()]
+            if frames[0] is None:
+                return
+            # Regroupe en un seul write les paquets déjà en file (producteur plus rapide que l'UART)
+            size, stop = len(frames[0]), False
+            while size < WRITE_COALESCE_BYTES:
+                try:
+                    data = tx_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if data is None:
+                    stop = True
+                    break
+                frames.append(data)
+                size += len(data)
+            try:
+                conn.write(b''.join(frames))
+            except Exception as e:
+                # Pas de déconnexion ici (un timeout peut être passager): l'erreur est remise à
+                # l'appelant par son prochain envoi ou par pop_write_error
+                print(f"Serial failed to write {size // 3} commands. Error: {e}")
+                errors.append(e)
+            if stop:
+                return
+
+    def get_serial_ports(self):
+        """Ports bruts (ListPortInfo), utilisables directement par connect_serial_device."""
+        now = time.monotonic()
+        if self._ports_cache is None or now - self._ports_cache_t >= PORTS_CACHE_TTL:
+            self._ports_cache = list(serial.tools.list_ports.comports())
+            self._ports_cache_t = now
+        return list(self._ports_cache)
+
     def get_serial_devices(self):
-        ports = serial.tools.list_ports.comports()
-        return [f"{p.device} - {p.description}" for p in ports]
+        return [f"{p.device} - {p.description}" for p in self.get_serial_ports()]
 
     def connect_serial_device(self, port_info) -> bool:
+        """port_info: chaîne "device - description" (get_serial_devices) ou ListPortInfo (get_serial_ports)."""
+        self._ports_cache = None
+        self._stop_writer()
         try:
-            port_name = port_info.split(' - ')[0]
+            port_name = getattr(port_info, 'device', None) or port_info.partition(' - ')[0]
             self.serial_connection = serial.Serial(
                 port=port_name,
                 baudrate=115200,
                 timeout=1,
                 write_timeout=1
             )
-            time.sleep(2)
+            # L'ouverture du port peut redémarrer l'ESP: on lit ses logs de boot jusqu'à la ligne
+            # "Ready" plutôt qu'un délai fixe. Sans redémarrage (pas de bannière), on retombe sur
+            # l'attente complète comme avant.
+            deadline = time.monotonic() + CONNECT_TIMEOUT
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.serial_connection.timeout = remaining
+                if self.serial_connection.readline().startswith(READY_BANNER):
+                    break
+            self.serial_connection.timeout = 1
+            self.serial_connection.reset_input_buffer()
             if self.serial_connection.is_open:
+                self._write_errors.clear()
+                if self.threaded_writes:
+                    self._start_writer()
                 self.connected = True
                 print(f"Serial connected to {port_name}")
                 return True
@@ -116,10 +274,13 @@ class SERIAL_API:
             return False
 
     def disconnect_serial_device(self) -> bool:
+        self._ports_cache = None
         try:
             if self.serial_connection and self.serial_connection.is_open:
-                self.serial_connection.close()
                 self.connected = False
+                self._stop_writer()
+                self.serial_connection.close()
+                self._pending.clear()
                 self.serial_connection = None
                 print('Serial disconnected')
                 return True